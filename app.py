@@ -20,11 +20,23 @@ import streamlit as st
 import re
 import time
 import datetime as dt
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Tuple, Dict, Optional
+from typing import Callable, List, Tuple, Dict, Optional
 import io
 
 # ====== PDF leitura ======
+try:
+    import pypdfium2 as pdfium
+    HAS_PDFIUM = True
+except Exception:
+    HAS_PDFIUM = False
+
 try:
     import pdfplumber
     HAS_PDFPLUMBER = True
@@ -37,15 +49,147 @@ except Exception:
         HAS_PYPDF2 = False
 
 # ====== Selenium ======
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver import ActionChains
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service as ChromeService
+# Importado só quando o robô é criado: quem apenas lê PDFs não paga o custo
+# de importação a cada rerun do Streamlit.
+webdriver = By = Keys = ActionChains = WebDriverWait = EC = None
+TimeoutException = NoSuchElementException = None
+ChromeDriverManager = ChromeService = None
+
+
+def _lazy_import_selenium():
+    global webdriver, By, Keys, ActionChains, WebDriverWait, EC
+    global TimeoutException, NoSuchElementException, ChromeDriverManager, ChromeService
+    if webdriver is not None:
+        return
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver import ActionChains
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException
+    from webdriver_manager.chrome import ChromeDriverManager
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
+
+@st.cache_resource
+def _chromedriver_path() -> str:
+    """Caminho do chromedriver resolvido pelo webdriver-manager, compartilhado por
+    todas as sessões do processo."""
+    return ChromeDriverManager().install()
+
+
+# ------------------------------
+# Padrões (regex pré-compilados)
+# ------------------------------
+_REAL = r"\d{1,3}(?:\.\d{3})*,\d{2}"
+_UF   = r"\d+(?:[.,]\d{1,5})"
+_UF_TOK = r"UFIMA(?:\(\s*s\s*\))?"
+
+# Correções de números quebrados na extração do PDF, numa única varredura.
+# As alternativas que começam por dígito compartilham o prefixo "d " e a
+# ordem importa: "1 2 345,67" precisa virar "12.345,67" antes que o caso de
+# milhar simples consuma o "2 345,67".
+_RE_FIX = re.compile(
+    r"(?P<rs>R\$\s*)(?P<rs_a>\d)\s(?P<rs_b>\d{1,2},\d{2})"        # R$ 1 2,34 / R$ 1 23,45
+    r"|(?P<d>\d)(?<!\d\d)\s(?:"
+    r"(?P<dup>\d)\s(?P<dup_c>\d{3},\d{2})(?!\d)"                  # 1 2 345,67
+    r"|(?P<mil>\d{3},\d{2})(?!\d)"                                # 1 234,56
+    r"|(?P<col>\d\.\d{3},\d{2})"                                  # 1 2.345,67
+    r"|\.(?P<pto>\d{3},\d{2}))"                                   # 1 .234,56
+)
+_RE_RS_DEPOIS = re.compile(r"(?<!\d)(" + _REAL + r")\s*R\$")
+_RE_WS = re.compile(r"[ \t]+")
+
+# Janela de tributos
+_RE_INI = re.compile(r"Valor da UFIMA Corrente\s*:\s*R\$\s*" + _REAL, re.I)
+_RE_INI_ALT = re.compile(r"Valor da UFIMA Corrente\s*:\s*" + _REAL + r"\s*R\$", re.I)
+_RE_FIM = re.compile(r"Total Geral\s+R\$\s*" + _REAL + r"\s+" + _UF + r"\s*" + _UF_TOK, re.I)
+
+# Cabeçalho da NL
+_RE_HEADER = re.compile(
+    r"(?P<proc>Processo\s+de\s+Origem[:\s]*(?P<proc_num>[\d\.\,]+))"
+    r"|(?P<procadm>PROCESSO\s+ADMINISTRATIVO\s*[:\s]*(?P<procadm_num>[\d\.\,]+))"
+    r"|(?P<nl>N[ºo]\s+(?P<nl_num>\d+/\d{4}))"
+    r"|(?P<cgm>CGM\s*[:]*)"
+    r"|(?P<mat>MATRICULA\s+IM[ÓO]VEL\s*[:]*)",
+    re.I
+)
+_HEADER_CAMPOS = frozenset({"proc", "nl", "cgm", "mat"})
+_RE_NUM4 = re.compile(r"\d{4,}")
+_RE_NUM2 = re.compile(r"\d{2,}")
+
+# Tributos
+_RE_TABELA_HDR = re.compile(
+    r"(?:Tributos para Lançamento|Descrição das Taxas de Obras)\s+Valor em R\$\s+Valor em UFIMA\(s\)\s*",
+    re.I
+)
+_RE_TRIBUTO = re.compile(
+    r"(?P<desc>(?:ISS\s*-\s*.+?|Taxa(?:s)?\s+de\s+Obras(?:\s*-\s*.+?)?))\s+"
+    r"R\$\s*(?P<rs>" + _REAL + r")\s+(?P<uf>" + _UF + r")\s*" + _UF_TOK,
+    re.I
+)
+
+# Tributos aceitos para lançamento (descrição já em minúsculas)
+_ALLOW_EQ = frozenset({
+    "taxas de obras",
+    "taxa de obras - vistoria residencial",
+    "taxa de obras - vistoria comercial",
+    "taxas de obras - renovação de alvará",
+})
+_ALLOW_PREFIX = ("iss -",)
+
+# Texto editado pelo usuário
+# Cabeçalho: cada campo fica num lookahead para que um não consuma o texto
+# do outro (o "\s*" após os dois-pontos pode atravessar a quebra de linha).
+_RE_TXT_HEADER = re.compile(
+    r"(?=(?P<proc>Processo de Origem:\s*(?P<proc_v>.+))"
+    r"|(?P<nl>NL:\s*(?P<nl_v>[0-9]+/[0-9]{4}))"
+    r"|(?P<cgm>CGM do Sujeito Passivo:\s*(?P<cgm_v>[0-9\.]+))"
+    r"|(?P<mat>Matrícula do Imóvel:\s*(?P<mat_v>.+)))"
+)
+# Campos do cabeçalho (grupos sem o sufixo "_v" do valor)
+_TXT_HEADER_CAMPOS = frozenset(n for n in _RE_TXT_HEADER.groupindex if not n.endswith("_v"))
+# Um lançamento por linha; [^\S\n] é espaço em branco sem atravessar a linha
+_RE_ITEM = re.compile(
+    r"^[^\S\n]*(?P<desc>\S.*?)[^\S\n]*\|[^\S\n]*R\$[^\S\n]*(?P<rs>" + _REAL + r")"
+    r"[^\S\n]*\|[^\S\n]*(?P<uf>[\d\.,]+)[^\S\n]*UFIMA\(s\)[^\S\n]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_RE_NAO_DIGITO = re.compile(r"\D")
+
+
+def _fix_rs(m: re.Match) -> str:
+    return m["rs"] + m["rs_a"] + m["rs_b"]
+
+def _fix_dup(m: re.Match) -> str:
+    return m["d"] + m["dup"] + "." + m["dup_c"]
+
+def _fix_mil(m: re.Match) -> str:
+    return m["d"] + "." + m["mil"]
+
+def _fix_col(m: re.Match) -> str:
+    return m["d"] + m["col"]
+
+def _fix_pto(m: re.Match) -> str:
+    return m["d"] + "." + m["pto"]
+
+# Cada alternativa de _RE_FIX termina num grupo próprio, então m.lastindex
+# identifica qual delas casou.
+_FIX_REPL: Tuple[Optional[Callable[[re.Match], str]], ...] = tuple(
+    {
+        _RE_FIX.groupindex["rs_b"]: _fix_rs,
+        _RE_FIX.groupindex["dup_c"]: _fix_dup,
+        _RE_FIX.groupindex["mil"]: _fix_mil,
+        _RE_FIX.groupindex["col"]: _fix_col,
+        _RE_FIX.groupindex["pto"]: _fix_pto,
+    }.get(i)
+    for i in range(_RE_FIX.groups + 1)
+)
+
+def _fix_glitch(m: re.Match) -> str:
+    """Reconstrói o trecho casado por _RE_FIX."""
+    return _FIX_REPL[m.lastindex](m)
 
 
 # ------------------------------
@@ -71,131 +215,234 @@ class NLData:
 # ------------------------------
 # Parser de PDF
 # ------------------------------
+# A partir de quantas páginas vale a pena extrair em paralelo
+_PAGINAS_PARALELO = 4
+_MAX_WORKERS_PDF = 4
+
+
+@st.cache_resource
+def _pdfium_lock() -> threading.Lock:
+    """Lock único por processo: o PDFium não é thread-safe e cada sessão do Streamlit
+    roda em sua própria thread (um lock global seria recriado a cada rerun do script)."""
+    return threading.Lock()
+
+
+def _page_text(page) -> str:
+    """Texto de uma página do pdfplumber.
+
+    O pdfplumber já dispensa a análise de layout do pdfminer (laparams=None);
+    o que pesa é o cache de objetos de cada página, liberado logo após a leitura.
+    """
+    try:
+        return page.extract_text() or ""
+    finally:
+        page.flush_cache()
+
+
+def _extract_pages(pdf_bytes: bytes, inicio: int, fim: int) -> List[str]:
+    """Extrai o texto das páginas [inicio, fim); roda em um processo separado."""
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return [_page_text(pdf.pages[i]) for i in range(inicio, fim)]
+
+
+def _em_ordem_de_leitura(textpage) -> bool:
+    """Confere se os trechos de texto do PDFium vêm de cima para baixo e, na mesma
+    linha, da esquerda para a direita (a ordem em que o pdfplumber monta o texto)."""
+    anterior = None
+    for i in range(textpage.count_rects()):
+        esq, base, _, topo = textpage.get_rect(i)
+        meio = (base + topo) / 2
+        if anterior is not None:
+            esq_ant, base_ant, topo_ant = anterior
+            if meio > topo_ant or (meio >= base_ant and esq < esq_ant):
+                return False
+        anterior = (esq, base, topo)
+    return True
+
+
 class PDFParser:
     def read_text(self, pdf_file) -> str:
         """Lê todas as páginas do PDF e devolve um texto único."""
         if HAS_PDFPLUMBER:
-            parts = []
             with pdfplumber.open(pdf_file) as pdf:
-                for p in pdf.pages:
-                    parts.append(p.extract_text() or "")
-            return "\n".join(parts)
+                n_paginas = len(pdf.pages)
+                workers = min(os.cpu_count() or 1, _MAX_WORKERS_PDF, n_paginas)
+                if n_paginas < _PAGINAS_PARALELO or workers < 2:
+                    return "\n".join(_page_text(p) for p in pdf.pages)
+            try:
+                return "\n".join(self._read_pages_parallel(pdf_file.getvalue(), n_paginas, workers))
+            except Exception:
+                # Sem multiprocessing disponível: volta para a leitura sequencial
+                with pdfplumber.open(pdf_file) as pdf:
+                    return "\n".join(_page_text(p) for p in pdf.pages)
         elif HAS_PYPDF2:
             reader = PdfReader(pdf_file)
             return "\n".join(page.extract_text() or "" for page in reader.pages)
         else:
             raise RuntimeError("Nenhuma biblioteca de PDF disponível (instale pdfplumber ou PyPDF2).")
 
+    @staticmethod
+    def _read_text_pdfium(pdf_file) -> Optional[str]:
+        """Extração rápida via PDFium; devolve o texto de todas as páginas em sequência.
+
+        O PDFium entrega o texto na ordem do content stream: se em alguma página essa
+        ordem não for a de leitura, devolve None para o texto ser lido pelo layout.
+        """
+        with _pdfium_lock():
+            pdf = pdfium.PdfDocument(pdf_file.getvalue())
+            try:
+                parts = []
+                for i in range(len(pdf)):
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    try:
+                        if not _em_ordem_de_leitura(textpage):
+                            return None
+                        parts.append(textpage.get_text_range())
+                    finally:
+                        textpage.close()
+                        page.close()
+            finally:
+                pdf.close()
+        return "\n".join(parts).replace("\r\n", "\n")
+
+    @staticmethod
+    def _read_pages_parallel(pdf_bytes: bytes, n_paginas: int, workers: int) -> List[str]:
+        """Divide as páginas em blocos contíguos, um por processo, e junta na ordem original."""
+        passo = -(-n_paginas // workers)
+        blocos = [(i, min(i + passo, n_paginas)) for i in range(0, n_paginas, passo)]
+        # forkserver: os processos não são cópias (fork) do servidor do Streamlit, que tem
+        # várias threads e poderia deixar um filho travado
+        ctx = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=len(blocos), mp_context=ctx) as ex:
+            futuros = [ex.submit(_extract_pages, pdf_bytes, ini, fim) for ini, fim in blocos]
+            return [texto for f in futuros for texto in f.result()]
+
     @staticmethod
     def _fix_numbers_glitches(s: str) -> str:
         """Corrige padrões quebrados que ocorrem ao extrair texto de PDF."""
-        s = re.sub(r"(R\$\s*)(\d)\s(\d,\d{2})", r"\1\2\3", s)
-        s = re.sub(r"(R\$\s*)(\d)\s(\d{2},\d{2})", r"\1\2\3", s)
-        s = re.sub(r"(?<!\d)(\d)\s(\d{3},\d{2})(?!\d)", r"\1.\2", s)
-        s = re.sub(r"(?<!\d)(\d)\s(\d\.\d{3},\d{2})", r"\1\2", s)
-        s = re.sub(r"(?<!\d)(\d)\s\.(\d{3},\d{2})", r"\1.\2", s)
-        s = re.sub(r"(?<!\d)(\d{1,3}(?:\.\d{3})*,\d{2})\s*R\$", r"R$ \1", s)
-        s = re.sub(r"[ \t]+", " ", s)
-        return s
-
-    def _recorte_janela(self, texto: str) -> str:
-        """Pega SOMENTE o trecho entre 'Valor da UFIMA Corrente' e 'Total Geral'."""
-        s = self._fix_numbers_glitches(texto)
-        REAL = r"\d{1,3}(?:\.\d{3})*,\d{2}"
-        UF   = r"\d+(?:[.,]\d{1,5})"
-
-        ini = re.search(r"Valor da UFIMA Corrente\s*:\s*R\$\s*" + REAL, s, flags=re.I)
+        s = _RE_FIX.sub(_fix_glitch, s)
+        # Só depois dos reparos: o valor movido pode ser um número recém-corrigido.
+        s = _RE_RS_DEPOIS.sub(r"R$ \1", s)
+        return _RE_WS.sub(" ", s)
+
+    def _recorte_janela(self, s: str) -> Optional[str]:
+        """Pega SOMENTE o trecho entre 'Valor da UFIMA Corrente' e 'Total Geral'
+        (no texto já corrigido); None se a janela não for encontrada."""
+        ini = _RE_INI.search(s)
         if not ini:
-            ini = re.search(r"Valor da UFIMA Corrente\s*:\s*" + REAL + r"\s*R\$", s, flags=re.I)
+            ini = _RE_INI_ALT.search(s)
 
+        # Vale o último "Total Geral": procura de trás para frente pela grafia usual
+        # e só varre com o regex o que vem depois (cobre "TOTAL GERAL" etc.)
         fim = None
-        for m in re.finditer(r"Total Geral\s+R\$\s*" + REAL + r"\s+" + UF + r"\s*UFIMA(?:\(\s*s\s*\))?",
-                             s, flags=re.I):
+        idx = s.rfind("Total Geral")
+        while idx != -1:
+            fim = _RE_FIM.match(s, idx)
+            if fim:
+                break
+            idx = s.rfind("Total Geral", 0, idx)
+        for m in _RE_FIM.finditer(s, fim.end() if fim else 0):
             fim = m
 
         if ini and fim:
             return s[ini.end(): fim.end()]
-        return s
+        return None
 
     def _parse_header_fields(self, text: str) -> Dict[str, str]:
         out = {"processo": "", "nl": "", "cgm": "", "matricula": ""}
 
-        m_processo = re.search(r"Processo\s+de\s+Origem[:\s]*([\d\.\,]+)", text, re.IGNORECASE)
-        if not m_processo:
-            m_processo = re.search(r"PROCESSO\s+ADMINISTRATIVO\s*[:\s]*([\d\.\,]+)", text, re.IGNORECASE)
+        # Uma única varredura, guardando a primeira ocorrência de cada campo;
+        # como todos ficam no topo da 1ª página, em geral ela para cedo.
+        achados: Dict[str, re.Match] = {}
+        for m in _RE_HEADER.finditer(text):
+            achados.setdefault(m.lastgroup, m)
+            if _HEADER_CAMPOS <= achados.keys():
+                break
+
+        m_processo = achados.get("proc") or achados.get("procadm")
         if m_processo:
-            out["processo"] = m_processo.group(1).strip()
+            out["processo"] = (m_processo["proc_num"] or m_processo["procadm_num"]).strip()
 
-        m_nl = re.search(r"N[ºo]\s+(\d+/\d{4})", text, re.IGNORECASE)
+        m_nl = achados.get("nl")
         if m_nl:
-            out["nl"] = m_nl.group(1).strip()
+            out["nl"] = m_nl["nl_num"].strip()
 
-        m_cgm_tag = re.search(r"CGM\s*[:]*", text, re.IGNORECASE)
+        m_cgm_tag = achados.get("cgm")
         if m_cgm_tag:
             sub = text[m_cgm_tag.end(): m_cgm_tag.end() + 120]
-            nums = re.findall(r"\d{4,}", sub)
+            nums = _RE_NUM4.findall(sub)
             if nums:
                 out["cgm"] = nums[-1].strip()
 
-        m_mat_tag = re.search(r"MATRICULA\s+IM[ÓO]VEL\s*[:]*", text, re.IGNORECASE)
+        m_mat_tag = achados.get("mat")
         if m_mat_tag:
             tail = text[m_mat_tag.end(): m_mat_tag.end() + 100]
             lines = [t.strip() for t in tail.splitlines() if t.strip()]
             if lines:
-                candidatos = re.findall(r"\d{2,}", lines[0])
+                candidatos = _RE_NUM2.findall(lines[0])
                 if candidatos:
                     out["matricula"] = candidatos[-1]
         return out
 
     def _extract_tributos_only(self, window_text: str) -> List[Tuple[str, str, str]]:
         """Extrai apenas os tributos permitidos."""
-        s = re.sub(r"Tributos para Lançamento\s+Valor em R\$\s+Valor em UFIMA\(s\)\s*", "", window_text, flags=re.I)
-        s = re.sub(r"Descrição das Taxas de Obras\s+Valor em R\$\s+Valor em UFIMA\(s\)\s*", "", s, flags=re.I)
+        s = _RE_TABELA_HDR.sub("", window_text)
         s = self._fix_numbers_glitches(s)
-        s = re.sub(r"\s+", " ", s)
-
-        uf_tok = r"UFIMA(?:\(\s*s\s*\))?"
-        REAL = r"\d{1,3}(?:\.\d{3})*,\d{2}"
-        UF   = r"\d+(?:[.,]\d{1,5})"
-        
-        pat = re.compile(
-            r"(?P<desc>(?:ISS\s*-\s*.+?|Taxa(?:s)?\s+de\s+Obras(?:\s*-\s*.+?)?))\s+"
-            r"R\$\s*(?P<rs>" + REAL + r")\s+(?P<uf>" + UF + r")\s*" + uf_tok,
-            flags=re.I
-        )
-
-        matches: List[Tuple[str, str, str, int]] = []
-        for m in pat.finditer(s):
-            desc = re.sub(r"\s{2,}", " ", m.group("desc")).strip(" -").strip()
-
-            allow = (
-                desc.lower().startswith("iss -") or
-                desc.lower() == "taxas de obras" or
-                desc.lower() == "taxa de obras - vistoria residencial" or
-                desc.lower() == "taxa de obras - vistoria comercial" or
-                desc.lower() == "taxas de obras - renovação de alvará"
-            )
-            if not allow:
+        s = " ".join(s.split())
+
+        # Deduplica por (descrição, valor) mantendo a ocorrência com a UFIMA mais
+        # longa; quando uma posterior vence, ela ocupa a sua própria posição.
+        out: List[Optional[Tuple[str, str, str]]] = []
+        seen: Dict[Tuple[str, str], int] = {}
+        for m in _RE_TRIBUTO.finditer(s):
+            # s já tem os espaços normalizados, então basta aparar a descrição
+            desc = m.group("desc").strip(" -")
+            dl = desc.lower()
+            if not (dl.startswith(_ALLOW_PREFIX) or dl in _ALLOW_EQ):
                 continue
 
-            rs = "R$ " + re.sub(r"(\d)\s(\d{3},\d{2})", r"\1.\2", m.group("rs").replace(" ", ""))
+            # _REAL não admite espaços: o valor capturado já vem normalizado
+            rs = "R$ " + m.group("rs")
             uf = m.group("uf").replace(".", ",") + " UFIMA(s)"
-            matches.append((desc, rs, uf, m.start()))
-
-        bykey: Dict[Tuple[str, str], Tuple[str, str, int]] = {}
-        for desc, rs, uf, pos in matches:
-            k = (desc.lower(), rs)
-            cur = bykey.get(k)
-            if (cur is None) or (len(uf) > len(cur[1])) or (len(uf) == len(cur[1]) and pos < cur[2]):
-                bykey[k] = (desc, uf, pos)
 
-        ordered = sorted([(pos, desc, rs, uf) for (desc_lower, rs), (desc, uf, pos) in bykey.items()],
-                         key=lambda t: t[0])
+            k = (dl, rs)
+            prev = seen.get(k)
+            if prev is not None:
+                if len(uf) <= len(out[prev][2]):
+                    continue
+                out[prev] = None
+            seen[k] = len(out)
+            out.append((desc, rs, uf))
 
-        return [(desc, rs, uf) for _, desc, rs, uf in ordered]
+        return [t for t in out if t is not None]
 
     def parse(self, pdf_file) -> NLData:
-        raw = self.read_text(pdf_file)
+        # PDFium primeiro; o texto dele só vale se trouxer a NL completa, senão
+        # a leitura é refeita pelo layout (pdfplumber)
+        raw = None
+        if HAS_PDFIUM:
+            try:
+                raw = self._read_text_pdfium(pdf_file)
+            except Exception:
+                raw = None  # PDF que o PDFium não consegue ler
+        if raw:
+            data = self._parse_text(raw, estrito=True)
+            if data is not None:
+                return data
+        return self._parse_text(self.read_text(pdf_file))
+
+    def _parse_text(self, raw: str, estrito: bool = False) -> Optional[NLData]:
+        """Monta o NLData a partir do texto do PDF. Com estrito, devolve None se faltar
+        a janela de tributos, algum tributo ou um dos campos Processo, NL e CGM."""
+        s = self._fix_numbers_glitches(raw)
+        janela = self._recorte_janela(s)
+        if janela is None:
+            if estrito:
+                return None
+            janela = s
+        rows = self._extract_tributos_only(janela)
+
         hdr = self._parse_header_fields(raw)
         data = NLData(
             processo_origem=hdr["processo"],
@@ -203,10 +450,9 @@ class PDFParser:
             cgm=hdr["cgm"],
             matricula=hdr["matricula"],
         )
-
-        janela = self._recorte_janela(raw)
-        rows = self._extract_tributos_only(janela)
         data.itens = [NLItem(d, r, u) for (d, r, u) in rows]
+        if estrito and not (data.processo_origem and data.numero_nl and data.cgm and data.itens):
+            return None
         return data
 
 
@@ -224,22 +470,38 @@ class ECidadeBot:
         'Taxas de Obras': '28',
         'Taxas de Obras - Renovação de Alvará': '28',
     }
+    _TIMEOUT = 30
+    # Os elementos costumam aparecer em menos de 100 ms; o padrão do Selenium é 0,5 s
+    _POLL = 0.05
+    # Linhas mantidas no log da tela; as mais antigas são descartadas
+    _MAX_LOGS = 200
+    # Campos do formulário de inclusão preenchidos em cada lançamento
+    _CAMPOS_INCLUSAO = ['dv05_procdiver', 'dv05_privenc', 'dv05_vlrhis', 'dv05_obs']
+    _JS_ALL_PRESENT = "return arguments[0].every(function (id) { return document.getElementById(id) !== null; });"
+    # Preenche o campo e dispara os eventos que o formulário escuta
+    _JS_SET_VALUE = (
+        "var e = document.getElementById(arguments[0]); e.value = arguments[1];"
+        "e.dispatchEvent(new Event('input', {bubbles: true}));"
+        "e.dispatchEvent(new Event('change', {bubbles: true}));"
+    )
+    # Chaves já normalizadas, na mesma ordem de PROC_MAP (a ordem decide empates)
+    _PROC_MATCHERS: List[Tuple[str, str]] = [(k.strip().lower(), v) for k, v in PROC_MAP.items()]
 
     def __init__(self, log_placeholder):
+        _lazy_import_selenium()
         self.log_area = log_placeholder
         self.driver: Optional[webdriver.Chrome] = None
         self.wait: Optional[WebDriverWait] = None
         self.actions: Optional[ActionChains] = None
+        self._proc_cache: Dict[str, str] = {}
 
     def log(self, msg: str):
         """Adiciona mensagem ao log do Streamlit."""
         if 'logs' not in st.session_state:
-            st.session_state.logs = []
+            st.session_state.logs = deque(maxlen=self._MAX_LOGS)
         st.session_state.logs.append(msg)
-        self.log_area.text_area("📡 Log do Sistema", 
-                                value="\n".join(st.session_state.logs), 
-                                height=200, 
-                                key=f"log_{len(st.session_state.logs)}")
+        # st.code não é widget: substitui o conteúdo do placeholder sem criar chave nova
+        self.log_area.code("\n".join(st.session_state.logs))
 
     def start(self, headless: bool = True):
         """Inicia o Chrome."""
@@ -268,15 +530,16 @@ class ECidadeBot:
         try:
             # Primeiro tentar com ChromeDriverManager
             try:
-                service = ChromeService(ChromeDriverManager().install())
+                service = ChromeService(_chromedriver_path())
                 self.driver = webdriver.Chrome(service=service, options=options)
             except Exception as e1:
+                _chromedriver_path.clear()
                 self.log(f"⚠️ ChromeDriverManager falhou, tentando chromedriver do sistema...")
                 # Fallback: usar chromedriver do sistema
                 service = ChromeService("/usr/bin/chromedriver")
                 self.driver = webdriver.Chrome(service=service, options=options)
             
-            self.wait = WebDriverWait(self.driver, 30)
+            self.wait = WebDriverWait(self.driver, self._TIMEOUT, poll_frequency=self._POLL)
             self.actions = ActionChains(self.driver)
             self.log("✅ Chrome iniciado com sucesso!")
         except Exception as e:
@@ -317,9 +580,7 @@ class ECidadeBot:
         
         self.wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="areas"]/span[2]'))).click()
         self.wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="modulos"]/span[2]'))).click()
-        time.sleep(0.2)
         self.wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="menu_id_32"]'))).click()
-        time.sleep(0.2)
         self.wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="menu_id_2233"]'))).click()
         self.wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="menu_id_2232"]'))).click()
         time.sleep(1)
@@ -352,23 +613,32 @@ class ECidadeBot:
         sem_pontos = sem.replace(".", "")
         return sem_pontos
 
-    @staticmethod
-    def _procedencia_for(descricao: str, proc_map: Dict[str, str]) -> str:
+    @classmethod
+    def _procedencia_for(cls, descricao: str) -> str:
         """Determina o código de procedência."""
         desc = descricao.strip().lower()
-        for k, v in proc_map.items():
-            if desc.startswith(k.strip().lower()):
-                return v
+        for key, code in cls._PROC_MATCHERS:
+            if desc.startswith(key):
+                return code
         if "iss" in desc:
-            if "ISS - Mão de Obra".lower() in (k.lower() for k in proc_map):
-                return proc_map["ISS - Mão de Obra"]
-        for k, v in proc_map.items():
-            if k.strip().lower() in desc:
-                return v
-        if "taxa" in desc or "taxas de obras" in desc:
-            return proc_map.get("Taxas de Obras", "")
+            return cls.PROC_MAP["ISS - Mão de Obra"]
+        for key, code in cls._PROC_MATCHERS:
+            if key in desc:
+                return code
+        if "taxa" in desc:
+            return cls.PROC_MAP.get("Taxas de Obras", "")
         return ""
 
+    def _wait_ready(self, ids: List[str]):
+        """Espera todos os campos existirem, com uma consulta JavaScript por verificação."""
+        WebDriverWait(self.driver, self._TIMEOUT, poll_frequency=self._POLL).until(
+            lambda d: d.execute_script(self._JS_ALL_PRESENT, ids)
+        )
+
+    def _js_set(self, el_id: str, value: str):
+        """Preenche um campo com um único comando WebDriver (em vez de clear + send_keys)."""
+        self.driver.execute_script(self._JS_SET_VALUE, el_id, value)
+
     def _tenta_aceitar_alerta(self):
         """Tenta aceitar alertas do navegador."""
         try:
@@ -382,35 +652,38 @@ class ECidadeBot:
     def lancar(self, data: NLData):
         """Realiza os lançamentos."""
         self.log("🚀 Iniciando lançamentos…")
+        obs_header = (
+            f"Processo de Origem: {data.processo_origem}\n"
+            f"NL: {data.numero_nl}\n"
+            f"Matrícula do Imóvel: {data.matricula}\n"
+        )
         for idx, item in enumerate(data.itens, start=1):
             self.log(f"━ Lançamento {idx}/{len(data.itens)}: {item.descricao}")
 
-            campo_cgm = self.wait.until(EC.presence_of_element_located((By.ID, 'z_numcgm')))
-            campo_cgm.clear()
-            campo_cgm.send_keys(data.cgm)
+            self._wait_ready(['z_numcgm'])
+            self._js_set('z_numcgm', data.cgm)
             self.wait.until(EC.element_to_be_clickable((By.XPATH, '/html/body/form/input'))).click()
-            time.sleep(0.3)
+            self._wait_ready(self._CAMPOS_INCLUSAO)
 
-            proc_code = self._procedencia_for(item.descricao, self.PROC_MAP)
+            proc_code = self._proc_cache.get(item.descricao)
+            if proc_code is None:
+                proc_code = self._proc_cache[item.descricao] = self._procedencia_for(item.descricao)
             if not proc_code:
                 raise RuntimeError(f"Não foi possível determinar a procedência para: {item.descricao}")
-            campo_proc = self.wait.until(EC.presence_of_element_located((By.ID, 'dv05_procdiver')))
-            campo_proc.clear()
-            campo_proc.send_keys(proc_code)
+            self._js_set('dv05_procdiver', proc_code)
 
             hoje = dt.date.today()
             delta = 30 if proc_code == "24" else 20
             venc = self._ajusta_vencimento(hoje, delta)
             dt_txt = self._data_ddmmyyyy_sem_barra(venc)
             self.log(f"   📅 Vencimento calculado: {venc.strftime('%d/%m/%Y')}")
-            campo_venc = self.wait.until(EC.presence_of_element_located((By.ID, 'dv05_privenc')))
+            # A data continua digitada: a máscara do campo só insere as barras ao teclar
+            campo_venc = self.driver.find_element(By.ID, 'dv05_privenc')
             campo_venc.clear()
             campo_venc.send_keys(dt_txt)
 
             vhist = self._normaliza_valor_brasil(item.valor_rs)
-            campo_vhist = self.wait.until(EC.presence_of_element_located((By.ID, 'dv05_vlrhis')))
-            campo_vhist.clear()
-            campo_vhist.send_keys(vhist)
+            self._js_set('dv05_vlrhis', vhist)
 
             try:
                 btn_calc = self.wait.until(EC.element_to_be_clickable((By.XPATH, '/html/body/form/fieldset/table/tbody/tr[5]/td/fieldset/table/tbody/tr[3]/td[2]/input[2]')))
@@ -418,16 +691,10 @@ class ECidadeBot:
                 time.sleep(0.8)
             except TimeoutException:
                 self.log("   [ℹ️] Botão de cálculo não encontrado; prosseguindo.")
+            self._wait_ready(['dv05_obs'])
 
-            obs = (
-                f"Processo de Origem: {data.processo_origem}\n"
-                f"NL: {data.numero_nl}\n"
-                f"Matrícula do Imóvel: {data.matricula}\n"
-                f"{item.descricao} | {item.valor_rs} | {item.valor_ufima}"
-            )
-            campo_obs = self.wait.until(EC.presence_of_element_located((By.ID, 'dv05_obs')))
-            campo_obs.clear()
-            campo_obs.send_keys(obs)
+            obs = obs_header + f"{item.descricao} | {item.valor_rs} | {item.valor_ufima}"
+            self._js_set('dv05_obs', obs)
 
             self.wait.until(EC.element_to_be_clickable((By.ID, 'db_opcao'))).click()
             time.sleep(0.6)
@@ -470,7 +737,11 @@ def main():
     if 'data_atual' not in st.session_state:
         st.session_state.data_atual = None
     if 'logs' not in st.session_state:
-        st.session_state.logs = []
+        st.session_state.logs = deque(maxlen=ECidadeBot._MAX_LOGS)
+    if 'pdf_cache' not in st.session_state:
+        st.session_state.pdf_cache = {}
+    if 'texto_editavel_init' not in st.session_state:
+        st.session_state.texto_editavel_init = ""
 
     # Formulário de credenciais
     col1, col2 = st.columns(2)
@@ -489,9 +760,15 @@ def main():
         if st.button("📥 Importar & Extrair Dados", type="primary"):
             with st.spinner("🔄 Processando PDF..."):
                 try:
-                    parser = PDFParser()
-                    data = parser.parse(pdf_file)
+                    # NLData já extraída é reaproveitada se o mesmo PDF for importado de novo
+                    pdf_hash = hashlib.blake2b(pdf_file.getvalue(), digest_size=16).hexdigest()
+                    data = st.session_state.pdf_cache.get(pdf_hash)
+                    if data is None:
+                        parser = PDFParser()
+                        data = parser.parse(pdf_file)
+                        st.session_state.pdf_cache[pdf_hash] = data
                     st.session_state.data_atual = data
+                    st.session_state.texto_editavel_init = montar_texto_editavel(data)
                     st.success("✅ Extração concluída com sucesso!")
                     st.info(f"🔍 {len(data.itens)} lançamento(s) encontrados na NL {data.numero_nl}")
                 except Exception as e:
@@ -517,20 +794,10 @@ def main():
 
         st.markdown("### 📊 Lançamentos a serem realizados:")
         
-        # Criar texto editável
-        texto_editavel = f"""Processo de Origem: {data.processo_origem}
-NL: {data.numero_nl}
-CGM do Sujeito Passivo: {data.cgm}
-Matrícula do Imóvel: {data.matricula}
-
-Lançamentos:
-"""
-        for item in data.itens:
-            texto_editavel += f"{item.descricao} | {item.valor_rs} | {item.valor_ufima}\n"
-
+        # Texto editável montado uma única vez, na importação
         texto_editado = st.text_area(
             "✏️ Você pode editar os dados abaixo antes de lançar:",
-            value=texto_editavel,
+            value=st.session_state.texto_editavel_init,
             height=300
         )
 
@@ -560,6 +827,7 @@ Lançamentos:
 
                 # Realizar lançamento
                 st.session_state.confirmar_lancamento = False
+                st.markdown("**📡 Log do Sistema**")
                 log_placeholder = st.empty()
                 
                 try:
@@ -582,37 +850,48 @@ Lançamentos:
     # Botão limpar
     if st.button("🧹 Limpar Tudo"):
         st.session_state.data_atual = None
-        st.session_state.logs = []
+        st.session_state.texto_editavel_init = ""
+        st.session_state.logs = deque(maxlen=ECidadeBot._MAX_LOGS)
         st.session_state.confirmar_lancamento = False
         st.rerun()
 
 
-def parse_texto_editado(texto: str) -> NLData:
-    """Reconstrói NLData a partir do texto editado."""
-    RE_PROC = re.compile(r"Processo de Origem:\s*(.+)")
-    RE_NL = re.compile(r"NL:\s*([0-9]+/[0-9]{4})")
-    RE_CGM = re.compile(r"CGM do Sujeito Passivo:\s*([0-9\.]+)")
-    RE_MAT = re.compile(r"Matrícula do Imóvel:\s*(.+)")
-    RE_ITEM = re.compile(
-        r"^(?P<desc>.+?)\s*\|\s*R\$\s*(?P<rs>\d{1,3}(?:\.\d{3})*,\d{2})\s*\|\s*(?P<uf>[\d\.,]+)\s*UFIMA\(s\)\s*$",
-        re.IGNORECASE
+def montar_texto_editavel(data: NLData) -> str:
+    """Monta o texto que o usuário pode editar antes do lançamento."""
+    linhas = [f"{i.descricao} | {i.valor_rs} | {i.valor_ufima}\n" for i in data.itens]
+    return (
+        f"Processo de Origem: {data.processo_origem}\n"
+        f"NL: {data.numero_nl}\n"
+        f"CGM do Sujeito Passivo: {data.cgm}\n"
+        f"Matrícula do Imóvel: {data.matricula}\n"
+        "\n"
+        "Lançamentos:\n"
+        + "".join(linhas)
     )
 
-    proc = (RE_PROC.search(texto).group(1).strip() if RE_PROC.search(texto) else "")
-    nl = (RE_NL.search(texto).group(1).strip() if RE_NL.search(texto) else "")
-    cgm = (RE_CGM.search(texto).group(1).strip() if RE_CGM.search(texto) else "")
-    cgm = re.sub(r"\D", "", cgm)
-    mat = (RE_MAT.search(texto).group(1).strip() if RE_MAT.search(texto) else "")
+
+def parse_texto_editado(texto: str) -> NLData:
+    """Reconstrói NLData a partir do texto editado."""
+    campos: Dict[str, str] = {}
+    for m in _RE_TXT_HEADER.finditer(texto):
+        campos.setdefault(m.lastgroup, m[m.lastgroup + "_v"].strip())
+        if _TXT_HEADER_CAMPOS <= campos.keys():
+            break
+    proc = campos.get("proc", "")
+    nl = campos.get("nl", "")
+    cgm = _RE_NAO_DIGITO.sub("", campos.get("cgm", ""))
+    mat = campos.get("mat", "")
 
     itens: List[NLItem] = []
-    for ln in texto.splitlines():
-        m = RE_ITEM.search(ln.strip())
-        if m:
-            desc = m.group("desc").strip()
-            vrs = f"R$ {m.group('rs')}"
-            vuf_raw = m.group("uf").replace(".", ",")
-            vuf = f"{vuf_raw} UFIMA(s)"
-            itens.append(NLItem(desc, vrs, vuf))
+    # Normaliza todas as quebras reconhecidas pelo splitlines ("\r", "\x0c", "\u2028"...)
+    # para "\n", a única que o "^"/"$" do regex reconhece
+    linhas = "\n".join(texto.splitlines())
+    for m in _RE_ITEM.finditer(linhas):
+        desc = m.group("desc").strip()
+        vrs = f"R$ {m.group('rs')}"
+        vuf_raw = m.group("uf").replace(".", ",")
+        vuf = f"{vuf_raw} UFIMA(s)"
+        itens.append(NLItem(desc, vrs, vuf))
 
     if not (proc and nl and cgm and itens):
         raise RuntimeError("Dados incompletos. Verifique Processo, NL, CGM e lançamentos.")